@@ -1,20 +1,33 @@
 import streamlit as st
-from typing import AsyncIterator, AsyncGenerator
-from agno.agent import RunOutput
-from team import get_agent_team
+from typing import TYPE_CHECKING, AsyncIterator, AsyncGenerator
 from random import choice
-import uuid
+import secrets
 import asyncio
+import threading
+import queue
+import atexit
+import sys
 import coloredlogs, logging
 import os
 import time
 
+if TYPE_CHECKING:
+    from agno.agent import RunOutput # annotation only -> agno isn't imported before login
+
 logger = logging.getLogger(__name__)
-coloredlogs.install(level=os.getenv("LOG_LEVEL", "INFO"), logger=logger)
+if not logger.handlers: # loggers outlive streamlit reruns -> only install the handler once
+    coloredlogs.install(level=os.getenv("LOG_LEVEL", "INFO"), logger=logger)
 
 # ALLOWED_EMAILS = set(config('ALLOWED_EMAILS').split(','))
 SHOW_PROGRESS_STATUS = True  # Show detailed progress updates to user
 AGENT_MODE = True # True if using a single agent, False if using the entre team
+CONTENT_EVENT = "RunContent" if AGENT_MODE else "TeamRunContent"
+STREAM_FLUSH_INTERVAL = 0.05 # seconds between markdown re-renders while streaming
+STREAM_FLUSH_CHUNKS = 8 # or re-render once this many chunks are pending
+NUM_VISIBLE_MESSAGES = 8 # older chat history is tucked into a collapsed expander
+HISTORY_LOAD_TIMEOUT = 5 # seconds to wait for a resumed session's history before starting with an empty chat
+
+EMPTY_TOOL_ARGS: dict = {} # shared read-only default for tool calls without args
 
 # User-friendly tool names
 TOOL_DISPLAY_NAMES = {
@@ -22,28 +35,48 @@ TOOL_DISPLAY_NAMES = {
     "search_web_multi": "Searching the Web",
     "fetch_url_contents": "Reading Product Pages",
     "fetch_urls": "Reading Product Pages",
+    "research": "Researching Products",
 }
 
+THINKING_MESSAGES = (
+    "Wrapping up ideas... 🎁",
+    "Shoveling through insights... ❄️",
+    "Skating through the data... ⛸️",
+    "Checking the North Pole archives... 🎅",
+    "Hopping province to province like a snowflake... ❄️",
+    "Sleigh-ing the search... 🛷",
+    "Brewing hot cocoa and facts... 🍫",
+    "Cutting fresh tracks through the web... 🎿",
+    "Gliding across frozen data lakes... 🧊",
+    "Lighting up the search like holiday lights... ✨",
+    "Searching from coast to *frozen* coast... 🌊",
+    "Consulting Canadian elves... 🧝‍♂️",
+    "Scooping up frosty findings... 🥶",
+    "Tuning into Santa’s signal... 🎅",
+    "Crunching through snow-covered stats... 📊",
+)
+
+PLACEHOLDER_PROMPTS = (
+    "Help me find a Christmas gift for my father 🎁",
+    "Looking for cozy Canadian-made slippers for my mom ❄️",
+    "Help me find a new flannel for my husband 🍁",
+    "Canadian made hockey stick for my son 🏒",
+    "Find me some cozy Canadian Christmas pajamas for my kids 🎄",
+    "I want to get my mom a new pair of snow boots ❄️",
+    "Looking for a Canadian-made sweater for my wife ❤️",
+    "Help me find a new pair of jeans for my daughter 👖",
+    "My wife needs a new pair of yoga pants - can you help? 🧘‍♀️",
+)
+
+INTRO_TEMPLATES = (
+    "Welcome {first_name}, how can I make your holiday season better? 🎄",
+    "Hi {first_name}, what can I do to help you this holiday season? ❄️",
+    "I'm glad you're here {first_name}, how can I help you this holiday season? 🎄",
+    "What can I do to help you this holiday season {first_name}? ❄️",
+)
+
 def get_thinking_message() -> str:
-    messages = [
-        "Wrapping up ideas... 🎁",
-        "Shoveling through insights... ❄️",
-        "Skating through the data... ⛸️",
-        "Checking the North Pole archives... 🎅",
-        "Hopping province to province like a snowflake... ❄️",
-        "Sleigh-ing the search... 🛷",
-        "Brewing hot cocoa and facts... 🍫",
-        "Cutting fresh tracks through the web... 🎿",
-        "Gliding across frozen data lakes... 🧊",
-        "Lighting up the search like holiday lights... ✨",
-        "Searching from coast to *frozen* coast... 🌊",
-        "Consulting Canadian elves... 🧝‍♂️",
-        "Scooping up frosty findings... 🥶",
-        "Tuning into Santa’s signal... 🎅",
-        "Crunching through snow-covered stats... 📊",
-    ]
-
-    return choice(messages)
+    return choice(THINKING_MESSAGES)
 
 # TODO: remove waitlist concept and just have the login screen
 
@@ -56,7 +89,44 @@ def login_screen():
     st.stop()      # keep showing login screen until user exists
 
 if "session_id" not in st.session_state:
-    st.session_state.session_id = str(uuid.uuid4())  # Generate new UUID
+    # Keep the session id in the URL so a page reload resumes the same agent session
+    session_id = st.query_params.get("sid")
+    # only a sid that came in with the URL can have history behind it -> a fresh one skips the db read
+    st.session_state.resumed_session = bool(session_id)
+    if not session_id:
+        session_id = secrets.token_hex(16)  # opaque random id
+        st.query_params["sid"] = session_id
+    st.session_state.session_id = session_id
+
+STREAM_DONE = object() # end-of-stream marker handed from the event loop to the script thread
+
+def shutdown_event_loop(loop: asyncio.AbstractEventLoop, thread: threading.Thread):
+    # close the pooled clients on their own loop, then stop and close the loop itself
+    team = sys.modules.get("team") # only loaded once someone logged in (and it brings in tools)
+    if team is not None:
+        for aclose in (team.aclose_model_client, team.aclose_client, team.db_engine.dispose):
+            try:
+                asyncio.run_coroutine_threadsafe(aclose(), loop).result(timeout=5)
+            except Exception as e:
+                logger.warning("Couldn't close %s: %s", aclose.__name__, e)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=5)
+    if not thread.is_alive():
+        loop.close()
+
+@st.cache_resource(show_spinner=False)
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    # One event loop for the whole process, run forever on a background thread:
+    # - every session's agent run is submitted to it (run_coroutine_threadsafe), so all sessions share the
+    #   model / tool HTTP/2 pools and the async db pool, and an ended session leaves no loop behind
+    # - it has no ScriptRunContext, so nothing on it calls st.*: the run hands its parsed events over a queue
+    #   and the session's own script thread does all the rendering (see process_stream)
+    # - sessions only overlap while each awaits I/O, so nothing on it may block: the db driver is async too
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name="agent-event-loop", daemon=True)
+    thread.start()
+    atexit.register(shutdown_event_loop, loop, thread)
+    return loop
 
 # def add_floating_button(
 #     colours: dict,
@@ -129,143 +199,74 @@ with st.sidebar:
     st.link_button("❤️ Help us improve", "https://forms.gle/5dWaY279oFsfwhTw9")
     st.link_button("📧 Contact us", "mailto:parkerbrydon@gmail.com")
 
-# Initialize session state for chat history
-if "messages" not in st.session_state:
-    st.session_state.messages = []
 
-async def parse_stream(stream: AsyncIterator[RunOutput]) -> AsyncGenerator[tuple[str, str], None]:
-    last_event_time = time.time()
+def get_tool_display(tool_name: str, tool_args: dict) -> str:
+    """Make tool names more user-friendly with context from args"""
+    if tool_name == "search_web_multi" and "queries" in tool_args:
+        queries = tool_args.get("queries", [])
+        if queries:
+            first_query = queries[0][:50] + "..." if len(queries[0]) > 50 else queries[0]
+            if len(queries) > 1:
+                return f"Searching for '{first_query}' and {len(queries)-1} more"
+            return f"Searching for '{first_query}'"
+        return "Searching the Web"
+    if tool_name == "fetch_urls" and "urls" in tool_args:
+        count = len(tool_args.get("urls", []))
+        return f"Reading {count} product page{'s' if count != 1 else ''}"
+    # only prettify the raw name when there's no display name (get()'s default is built eagerly)
+    return TOOL_DISPLAY_NAMES.get(tool_name) or tool_name.replace("_", " ").title()
+
+async def parse_stream(stream: AsyncIterator["RunOutput"]) -> AsyncGenerator[tuple[str, str], None]:
+    last_event_time = time.monotonic()  # only read when leaving the "start" / "analyzing" phases
     last_event = "start"
     tool_start_time = None
     current_tool = None
-    planning_start_time = time.time()  # Start timing from the beginning
+    planning_start_time = time.monotonic()  # Start timing from the beginning
     
     async for chunk in stream:
-        logger.debug(f"{chunk.event if hasattr(chunk, 'event') else 'unknown'}")
-        if hasattr(chunk, "event"):
-            if AGENT_MODE:
-                if chunk.event == 'RunContent' and chunk.content:
-                    if last_event != "content":
-                        # Complete any pending analyzing phase
-                        if planning_start_time and last_event == "analyzing":
-                            elapsed = time.time() - planning_start_time
-                            logger.info(f"💭 LLM generating response (took {elapsed:.2f}s to process)")
-                            yield ("status_complete", f"✅ ({int(round(elapsed))}s)")
-                            planning_start_time = None
-                        elif planning_start_time:
-                            elapsed = time.time() - planning_start_time
-                            logger.info(f"💭 LLM generating response (took {elapsed:.2f}s to process)")
-                            yield ("status_complete", f"✅ ({int(round(elapsed))}s)")
-                            planning_start_time = None
-                        yield ("status_start", "💭 Generating response...")
-                        last_event = "content"
-                        last_event_time = time.time()
-                    yield ("content", chunk.content)
-                elif SHOW_PROGRESS_STATUS and chunk.event == "ToolCallStarted":
-                    # Complete previous analyzing/thinking phase
-                    if last_event in ["analyzing", "start"]:
-                        elapsed = time.time() - last_event_time
-                        logger.info(f"🧠 LLM planning took {elapsed:.2f}s")
-                        yield ("status_complete", f"✅ ({int(round(elapsed))}s)")
-                        planning_start_time = None
-                    
-                    logger.info(f"🔧 Calling {chunk.tool.tool_name}")
-                    
-                    # Make tool names more user-friendly with context from args
-                    current_tool = chunk.tool.tool_name
-                    tool_args = chunk.tool.tool_args if hasattr(chunk.tool, 'tool_args') else {}
-                    
-                    # Create descriptive message based on tool and args
-                    if current_tool == "search_web_multi" and "queries" in tool_args:
-                        queries = tool_args.get("queries", [])
-                        if queries:
-                            first_query = queries[0][:50] + "..." if len(queries[0]) > 50 else queries[0]
-                            if len(queries) > 1:
-                                tool_display = f"Searching for '{first_query}' and {len(queries)-1} more"
-                            else:
-                                tool_display = f"Searching for '{first_query}'"
-                        else:
-                            tool_display = "Searching the Web"
-                    elif current_tool == "fetch_urls" and "urls" in tool_args:
-                        urls = tool_args.get("urls", [])
-                        count = len(urls)
-                        tool_display = f"Reading {count} product page{'s' if count != 1 else ''}"
-                    else:
-                        tool_display = TOOL_DISPLAY_NAMES.get(current_tool, current_tool.replace("_", " ").title())
-                    
-                    tool_start_time = time.time()
-                    last_event = "tool_call"
-                    last_event_time = time.time()
-                    yield ("status_start", f"🔍 {tool_display}...")
-                elif chunk.event == "ToolCallCompleted":
-                    if tool_start_time and current_tool:
-                        elapsed = time.time() - tool_start_time
-                        logger.info(f"✅ {current_tool} completed in {elapsed:.2f}s total")
-                        yield ("status_complete", f"✅ ({int(round(elapsed))}s)")
-                        last_event_time = time.time()
-                        # Start analyzing phase immediately after tool completion
-                        planning_start_time = time.time()
-                        yield ("status_start", "🧠 Analyzing results...")
-                        last_event = "analyzing"
-            else:
-                if chunk.event == 'TeamRunContent' and chunk.content:
-                    if last_event != "content":
-                        # Complete any pending planning
-                        if planning_start_time:
-                            elapsed = time.time() - planning_start_time
-                            logger.info(f"💭 LLM generating response (took {elapsed:.2f}s to process)")
-                            yield ("status_complete", f"✅ ({int(round(elapsed))}s)")
-                            planning_start_time = None
-                        yield ("status_start", "💭 Generating response...")
-                        last_event = "content"
-                        last_event_time = time.time()
-                    yield ("content", chunk.content)
-                elif SHOW_PROGRESS_STATUS and chunk.event == "ToolCallStarted":
-                    # Complete previous analyzing/thinking phase
-                    if last_event in ["analyzing", "start"]:
-                        elapsed = time.time() - last_event_time
-                        logger.info(f"🧠 LLM planning took {elapsed:.2f}s")
-                        yield ("status_complete", f"✅ ({int(round(elapsed))}s)")
-                        planning_start_time = None
-                    
-                    logger.info(f"🔧 Calling {chunk.tool.tool_name}")
-                    
-                    # Make tool names more user-friendly with context from args
-                    current_tool = chunk.tool.tool_name
-                    tool_args = chunk.tool.tool_args if hasattr(chunk.tool, 'tool_args') else {}
-                    
-                    # Create descriptive message based on tool and args
-                    if current_tool == "search_web_multi" and "queries" in tool_args:
-                        queries = tool_args.get("queries", [])
-                        if queries:
-                            first_query = queries[0][:50] + "..." if len(queries[0]) > 50 else queries[0]
-                            if len(queries) > 1:
-                                tool_display = f"Searching for '{first_query}' and {len(queries)-1} more"
-                            else:
-                                tool_display = f"Searching for '{first_query}'"
-                        else:
-                            tool_display = "Searching the Web"
-                    elif current_tool == "fetch_urls" and "urls" in tool_args:
-                        urls = tool_args.get("urls", [])
-                        count = len(urls)
-                        tool_display = f"Reading {count} product page{'s' if count != 1 else ''}"
-                    else:
-                        tool_display = TOOL_DISPLAY_NAMES.get(current_tool, current_tool.replace("_", " ").title())
-                    
-                    tool_start_time = time.time()
-                    last_event = "tool_call"
-                    last_event_time = time.time()
-                    yield ("status_start", f"🔍 {tool_display}...")
-                elif chunk.event == "ToolCallCompleted":
-                    if tool_start_time and current_tool:
-                        elapsed = time.time() - tool_start_time
-                        logger.info(f"✅ {current_tool} completed in {elapsed:.2f}s total")
-                        yield ("status_complete", f"✅ ({int(round(elapsed))}s)")
-                        last_event_time = time.time()
-                        # Start analyzing phase immediately after tool completion
-                        planning_start_time = time.time()
-                        yield ("status_start", "🧠 Analyzing results...")
-                        last_event = "analyzing"
+        event = getattr(chunk, "event", None)
+        logger.debug("%s", event)
+        if event is None:
+            continue
+        if event == CONTENT_EVENT and chunk.content:
+            if last_event != "content":
+                # Complete any pending analyzing / planning phase
+                if planning_start_time:
+                    elapsed = time.monotonic() - planning_start_time
+                    logger.info("💭 LLM generating response (took %.2fs to process)", elapsed)
+                    yield ("status_complete", f"✅ ({elapsed:.0f}s)")
+                    planning_start_time = None
+                yield ("status_start", "💭 Generating response...")
+                last_event = "content"
+            yield ("content", chunk.content)
+        elif SHOW_PROGRESS_STATUS and event == "ToolCallStarted":
+            # Complete previous analyzing/thinking phase
+            if last_event in ["analyzing", "start"]:
+                elapsed = time.monotonic() - last_event_time
+                logger.info("🧠 LLM planning took %.2fs", elapsed)
+                yield ("status_complete", f"✅ ({elapsed:.0f}s)")
+                planning_start_time = None
+            
+            tool = chunk.tool
+            current_tool = tool.tool_name
+            tool_args = getattr(tool, "tool_args", None) or EMPTY_TOOL_ARGS
+            logger.info("🔧 Calling %s", current_tool)
+            
+            tool_display = get_tool_display(current_tool, tool_args)
+            
+            tool_start_time = time.monotonic()
+            last_event = "tool_call"
+            yield ("status_start", f"🔍 {tool_display}...")
+        elif event == "ToolCallCompleted":
+            if tool_start_time and current_tool:
+                elapsed = time.monotonic() - tool_start_time
+                logger.info("✅ %s completed in %.2fs total", current_tool, elapsed)
+                yield ("status_complete", f"✅ ({elapsed:.0f}s)")
+                last_event_time = time.monotonic()
+                # Start analyzing phase immediately after tool completion
+                planning_start_time = time.monotonic()
+                yield ("status_start", "🧠 Analyzing results...")
+                last_event = "analyzing"
             
 
 def show_waitlist(show_error: bool = True):
@@ -277,7 +278,12 @@ def show_waitlist(show_error: bool = True):
     st.write("[Join the waitlist 📬](https://stan.store/brydon/p/canadian-ai-waitlist-)")
     st.markdown("---")
 
-if not hasattr(st, 'user') or not hasattr(st.user, 'is_logged_in') or not st.user.is_logged_in:
+# Read the auth state once per rerun (st.user attributes go through the auth backend)
+user = getattr(st, 'user', None)
+is_logged_in = bool(user is not None and getattr(user, 'is_logged_in', False))
+user_email = user.email if is_logged_in else None
+
+if not is_logged_in:
     login_screen()
     # show_waitlist(show_error=False)
 # elif st.user.email not in ALLOWED_EMAILS:
@@ -286,42 +292,87 @@ if not hasattr(st, 'user') or not hasattr(st.user, 'is_logged_in') or not st.use
 else:
     # Show the main app interface
     # Sidebar content
+    def new_chat():
+        # a fresh sid starts a new agent session; the old one stays stored under its own id
+        st.session_state.session_id = st.query_params["sid"] = secrets.token_hex(16)
+        st.session_state.messages = []
+
     with st.sidebar:
+        st.button("📝 New chat", on_click=new_chat, type="secondary")
         st.button("🔐 Log out", on_click=st.logout, type="secondary")
     
     # Main content
     st.title("Snowman ☃️")
     st.caption("Christmas ❄️ Shopping Assistant that is biased to support Canadian businesses 🍁")
-    first_name = st.user.name.split(' ')[0] if hasattr(st, 'user') else 'Guest'
-    intro_messages = [
-        f"Welcome {first_name}, how can I make your holiday season better? 🎄",
-        f"Hi {first_name}, what can I do to help you this holiday season? ❄️",
-        f"I'm glad you're here {first_name}, how can I help you this holiday season? 🎄",
-        f"What can I do to help you this holiday season {first_name}? ❄️",
-    ]
-    st.write(choice(intro_messages)) 
+    user_name = user.name
+    first_name = user_name.split(' ', 1)[0] if user_name else 'Guest'
+    st.write(choice(INTRO_TEMPLATES).format(first_name=first_name))
+
+
+if is_logged_in:
+    # imported behind the login gate so the login screen doesn't wait on agent / db setup
+    from team import get_agent_team, warm_up
+
+    @st.cache_resource(show_spinner=False)
+    def start_warm_up():
+        # in the background on the shared loop (the pools it warms belong to that loop); cache_resource is
+        # what makes this once per process -> keep it cached, like get_event_loop / the agent
+        return asyncio.run_coroutine_threadsafe(warm_up(get_agent_team()), get_event_loop())
+
+    start_warm_up()
+
+    # stores the session history for each user; agno loads sessions by id alone, so scope the
+    # URL's sid to the user -> a shared link can't read someone else's history
+    agent_session_id = f"{user_email}:{st.session_state.session_id}"
 
+    def load_messages() -> list:
+        # after a reload the sid in the URL resumes the agent session -> show its history again too
+        if not st.session_state.resumed_session:
+            return []
+        try:
+            # the db is async -> read it on the shared loop (this thread just waits for the result)
+            load = asyncio.run_coroutine_threadsafe(
+                get_agent_team().aget_session(session_id=agent_session_id), get_event_loop()
+            )
+            session = load.result(timeout=HISTORY_LOAD_TIMEOUT)
+        except TimeoutError:
+            load.cancel() # a slow / stuck db read doesn't hold up the page, nor linger on the loop
+            logger.warning("Loading the chat history timed out after %ss", HISTORY_LOAD_TIMEOUT)
+            return []
+        except Exception as e:
+            logger.warning("Couldn't load the chat history: %s", e)
+            return []
+        messages = []
+        for run in (session.runs or []) if session else []:
+            if run.input is None or not isinstance(run.content, str) or not run.content:
+                continue # e.g. a run that errored / was cancelled before answering
+            messages.append({"role": "user", "content": run.input.input_content_string()})
+            messages.append({"role": "assistant", "content": run.content})
+        return messages
 
-if hasattr(st.user, 'is_logged_in') and st.user.is_logged_in:
+    # Initialize session state for chat history
+    if "messages" not in st.session_state:
+        st.session_state.messages = load_messages()
 
-    # Display chat messages
-    for message in st.session_state.messages:
+    def show_message(message: dict):
         with st.chat_message(message["role"], avatar="🎄" if message["role"] == "assistant" else "❄️"):
             st.markdown(message["content"])
 
-    @st.cache_data # not sure why but it breaks if we don't cache this
+    # Display chat messages (only the most recent ones expanded)
+    earlier_messages = st.session_state.messages[:-NUM_VISIBLE_MESSAGES]
+    if earlier_messages:
+        with st.expander(f"Earlier messages ({len(earlier_messages)})", expanded=False):
+            for message in earlier_messages:
+                show_message(message)
+    for message in st.session_state.messages[-NUM_VISIBLE_MESSAGES:]:
+        show_message(message)
+
+    # the placeholder is part of chat_input's widget identity -> a new one every rerun
+    # resets the widget and drops the submitted prompt, so pick one per session and keep it
     def get_placeholder():
-        return choice([
-            "Help me find a Christmas gift for my father 🎁",
-            "Looking for cozy Canadian-made slippers for my mom ❄️",
-            "Help me find a new flannel for my husband 🍁",
-            "Canadian made hockey stick for my son 🏒",
-            "Find me some cozy Canadian Christmas pajamas for my kids 🎄",
-            "I want to get my mom a new pair of snow boots ❄️",
-            "Looking for a Canadian-made sweater for my wife ❤️",
-            "Help me find a new pair of jeans for my daughter 👖",
-            "My wife needs a new pair of yoga pants - can you help? 🧘‍♀️",
-        ])
+        if "placeholder" not in st.session_state:
+            st.session_state.placeholder = choice(PLACEHOLDER_PROMPTS)
+        return st.session_state.placeholder
 
     # add_floating_button(
     #     link="https://buymeacoffee.com/brydon",
@@ -331,13 +382,15 @@ if hasattr(st.user, 'is_logged_in') and st.user.is_logged_in:
     #     colours={"background": "#f8f9fa", "text": "#666", "text_hover": "#222", "background_hover": "#f1f3f4"}
     # )
 
-    async def run_agent():
-        return agent_team.arun(
+    def run_agent(prompt: str):
+        # get_agent_team is @st.cache_resource -> the same agent is reused for every prompt
+        # (called on the script thread: the cache and session_state need its script context)
+        return get_agent_team().arun(
             prompt, 
             stream=True,
             stream_events=True,
-            user_id=st.user.email, # stores memories for the user
-            session_id=st.session_state.session_id, # stores the session history for each user
+            user_id=user_email, # stores memories for the user
+            session_id=agent_session_id,
         )
 
     if prompt := st.chat_input(
@@ -355,60 +408,107 @@ if hasattr(st.user, 'is_logged_in') and st.user.is_logged_in:
             message_placeholder = st.empty()
             
             with st.spinner(get_thinking_message()):
-                start_time = time.time()
+                start_time = time.monotonic()
                 logger.info(f"🚀 Starting agent run for: {prompt[:50]}...")
-                agent_team = get_agent_team()
                 
-                # Create and run the async processing
-                async def process_stream():
-                    response_parts = []
-                    stream_start = time.time()
-                    stream = await run_agent()
-                    stream_ready_time = time.time() - stream_start
-                    logger.info(f"⚡ Stream ready in {stream_ready_time:.2f}s")
-                    
-                    parsed_stream = parse_stream(stream)
-                    
+                def process_stream():
+                    stream = run_agent(prompt)
+                    events: queue.Queue = queue.Queue()
+
+                    async def produce():
+                        # runs on the shared loop: the agent run + parsing, each event handed to this script thread
+                        stream_start = time.monotonic()
+                        try:
+                            async for event in parse_stream(stream):
+                                if stream_start:
+                                    logger.info(f"⚡ First event in {time.monotonic() - stream_start:.2f}s")
+                                    stream_start = None
+                                events.put(event)
+                        finally:
+                            events.put(STREAM_DONE)
+
+                    run = asyncio.run_coroutine_threadsafe(produce(), get_event_loop())
+                    try:
+                        return render_stream(events, run)
+                    finally:
+                        run.cancel() # no-op once finished; stops the agent run if the user reran / stopped mid-answer
+
+                def render_stream(events: queue.Queue, run) -> str:
                     # Use separate placeholders for status and content
                     status_container = st.empty()
                     response_placeholder = st.empty()
                     current_response = ""
-                    status_lines = ["🧠 Thinking..."]  # Start with initial thinking status
-                    status_container.caption("\n\n".join(status_lines))
+                    pending_chunks = 0
+                    last_flush = time.monotonic()
+                    # Status lines joined with double line breaks, kept as one running string
+                    status_text = "🧠 Thinking..."  # Start with initial thinking status
+                    status_container.caption(status_text)
+
+                    def flush_response(text: str):
+                        # markdown() re-parses the whole response, so coalesce chunks between renders
+                        nonlocal pending_chunks, last_flush
+                        if pending_chunks:
+                            response_placeholder.markdown(text)
+                            pending_chunks = 0
+                        last_flush = time.monotonic()
                     
-                    async for content_type, content in parsed_stream:
+                    while True:
+                        # with chunks pending, wait no longer than the flush interval -> they still render
+                        # when the model pauses (e.g. while it starts a tool call) instead of at the next chunk
+                        timeout = (
+                            max(0.0, STREAM_FLUSH_INTERVAL - (time.monotonic() - last_flush))
+                            if pending_chunks else None
+                        )
+                        try:
+                            event = events.get(timeout=timeout)
+                        except queue.Empty:
+                            flush_response(current_response)
+                            continue
+                        if event is STREAM_DONE:
+                            break
+                        content_type, content = event
                         if content_type == "status_start":
+                            flush_response(current_response)
                             # Add a new status line (in progress)
-                            status_lines.append(content)
-                            # Display all status lines with double line breaks and faded color
-                            status_container.caption("\n\n".join(status_lines))
+                            status_text = f"{status_text}\n\n{content}" if status_text else content
+                            # Display all status lines with faded color
+                            status_container.caption(status_text)
                         elif content_type == "status_complete":
-                            # Update the last in-progress line with completion info
-                            if status_lines:
+                            flush_response(current_response)
+                            # Update the last in-progress line (the end of the text) with completion info
+                            if status_text:
                                 # Keep the "..." and add checkmark with timing
-                                status_lines[-1] = f"{status_lines[-1]} {content}"
-                            # Display all status lines with double line breaks and faded color
-                            status_container.caption("\n\n".join(status_lines))
+                                status_text = f"{status_text} {content}"
+                            # Display all status lines with faded color
+                            status_container.caption(status_text)
                         elif content_type == "content":
                             # Clear status when regular content arrives
-                            if status_lines:
+                            if status_text:
                                 status_container.empty()
-                                status_lines = []
+                                status_text = ""
                             
                             # Update regular content
-                            response_parts.append(content)
-                            current_response = "".join(response_parts)
-                            response_placeholder.markdown(current_response)
+                            current_response += content # appends in place, no re-join of every chunk
+                            pending_chunks += 1
+                            if (
+                                pending_chunks >= STREAM_FLUSH_CHUNKS
+                                or time.monotonic() - last_flush >= STREAM_FLUSH_INTERVAL
+                            ):
+                                flush_response(current_response)
                     
+                    # Render whatever is still pending once the stream ends
+                    flush_response(current_response)
+
                     # Ensure status placeholder is cleared at the end
-                    if status_lines:
+                    if status_text:
                         status_container.empty()
-                    
+
+                    run.result() # re-raise anything the agent run failed with
                     return current_response
                 
-                # Run the async process
-                full_response = asyncio.run(process_stream())
-                total_time = time.time() - start_time
+                # Run the agent on the shared loop and render its events here as they arrive
+                full_response = process_stream()
+                total_time = time.monotonic() - start_time
                 logger.info(f"✨ Total response time: {total_time:.2f}s")
 
             st.session_state.messages.append({"role": "assistant", "content": full_response})
\ No newline at end of file
@@ -1,17 +1,22 @@
 import streamlit as st
+from streamlit import runtime
 from agno.agent import Agent
 from agno.models.openai import OpenAIChat
 # from agno.models.cohere import Cohere # TODO: fix this not working now
 from textwrap import dedent
-from agno.db.postgres import PostgresDb
+from agno.db.postgres import AsyncPostgresDb
+from sqlalchemy.ext.asyncio import create_async_engine
 from decouple import config
-from tools import fetch_urls, search_web_multi
+from tools import aclose_client, fetch_urls, research, search_web_multi
 import os
+import asyncio
+import httpx
 import coloredlogs, logging
 
 # Create a logger object.
 logger = logging.getLogger(__name__)
-coloredlogs.install(level=os.getenv("LOG_LEVEL", "INFO"), logger=logger)
+if not logger.handlers: # loggers outlive streamlit reruns -> only install the handler once
+    coloredlogs.install(level=os.getenv("LOG_LEVEL", "INFO"), logger=logger)
 
 # TODO: handle context windows getting too large
 
@@ -30,6 +35,21 @@ ADDITIONAL_CONTEXT = dedent("""
 """)
 MAX_TOOL_CALLS = 3
 NUM_HISTORY_RUNS = 3
+# raw search / page dumps are the bulk of the history tokens and the answers already summarise them
+# -> only replay the most recent turn's worth of tool results
+MAX_HISTORY_TOOL_CALLS = MAX_TOOL_CALLS
+MAX_MODEL_RETRIES = 5 # openai client retries 429/5xx/connection errors w exponential backoff + jitter
+MODEL_MAX_CONNECTIONS = 200
+MODEL_MAX_KEEPALIVE_CONNECTIONS = 50
+# routes every turn to the same OpenAI prompt cache -> the static instructions / tool schemas prefix gets reused
+# (the datetime from add_datetime_to_context lands after the instructions so it doesn't break the prefix)
+PROMPT_CACHE_KEY = "snowman-product-finder"
+# the async pool is used from the one shared event loop: a connection is only checked out while one of agno's
+# per-turn session reads / upserts is in flight, so it has to cover the turns starting or finishing at the same
+# moment, not every open session -> a few warm connections, with overflow for bursts of users
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "15"))
+DB_POOL_RECYCLE = 60*60 # seconds, recycle before the server / proxy drops idle connections
 
 # TODO: more search results with LLM reranking on top?
 # TODO: switch over to cohere LLM
@@ -40,10 +60,12 @@ product_finding_instructions = dedent(f"""
     Find 5-10 options ranked by your evaluation of which are the best.
 
     Here's the tools you have to use:
+    - research: search the web and fetch the top result pages in one call (prefer this to start)
     - search_web_multi: search the web for information in parallel
     - fetch_urls: fetch the contents of a list of urls
 
     You should batch all search and fetch operations to minimize tool calls.
+    Start with a single research call, only use search_web_multi / fetch_urls to fill in gaps.
     In general you shouldn't be making more than {MAX_TOOL_CALLS} tool calls per request.
     You shouldn't take longer than 10 seconds to complete your task.
                     
@@ -74,24 +96,80 @@ product_finding_instructions = dedent(f"""
 # ------------database / storage / setup
 db_url = f"postgresql+psycopg://{config('POSTGRES_USER')}:{config('POSTGRES_PASSWORD')}@{config('POSTGRES_HOST')}/{config('POSTGRES_DB')}"
 
-team_storage = PostgresDb(
-    db_url=db_url
+# one pooled engine per process (modules import once, so this is shared by every streamlit session)
+# async (psycopg 3's async driver) -> agno awaits each session read / write instead of blocking the event loop,
+# so one user's db round-trip doesn't stall everyone else's stream (see main.get_event_loop)
+# pre_ping -> a connection dropped while idle is replaced instead of failing a user's turn
+db_engine = create_async_engine(
+    db_url,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=DB_POOL_RECYCLE,
 )
 
+team_storage = AsyncPostgresDb(
+    db_url=db_url,
+    db_engine=db_engine,
+)
+
+# One HTTP/2 client for the model calls, shared by every turn -> requests multiplex over a warm TLS connection.
+# All agent runs happen on a single event loop (the app's shared loop / the CLI's Runner), and that's the
+# loop the pool binds to on first use
+model_http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(
+        max_connections=MODEL_MAX_CONNECTIONS,
+        max_keepalive_connections=MODEL_MAX_KEEPALIVE_CONNECTIONS,
+    ),
+)
+
+async def aclose_model_client():
+    # close the model's pooled connections (on the loop they were opened on) -> app shutdown / end of the CLI
+    await model_http_client.aclose()
+
 # TODO:
 # 1. verify the memory still works
 # 2. understand the routing
 # 3. verify the web search is working
 
-@st.cache_resource
-def get_agent_team():
+async def warm_up_storage():
+    # open one pooled connection up front -> the first user turn doesn't pay the connect + TLS handshake
+    # (async engine -> has to run on the loop that later uses the pool)
+    logger.info("Priming the Postgres connection pool")
+    try:
+        async with team_storage.db_engine.connect():
+            pass
+    except Exception as e:
+        logger.warning("Couldn't prime the Postgres connection pool: %s", e)
+
+async def warm_up_model(model: OpenAIChat):
+    # open the HTTP/2 connection to the model API up front (listing models is the cheapest authenticated call)
+    logger.info("Opening the model API connection")
+    try:
+        await model.get_async_client().models.list()
+    except Exception as e:
+        logger.warning("Couldn't open the model API connection: %s", e)
+
+async def warm_up(agent: Agent):
+    # run on the loop that later serves the turns: the pools it fills are bound to it.
+    # only called once per process because its callers are: main.start_warm_up (st.cache_resource) / the CLI's main
+    await asyncio.gather(warm_up_storage(), warm_up_model(agent.model))
+
+def build_agent_team():
     product_finder_agent = Agent(
         name="Product Finder Agent",
         role="Find and recommend products",
         # model=Cohere(id="command-a-03-2025"),
         # model=OpenAIChat(id="gpt-4.1"), # so much better than 4.1-mini for the umbrella question
-        model=OpenAIChat(id=AGENT_MODEL_ID),
+        model=OpenAIChat(
+            id=AGENT_MODEL_ID,
+            http_client=model_http_client,
+            max_retries=MAX_MODEL_RETRIES,
+            request_params={"prompt_cache_key": PROMPT_CACHE_KEY},
+        ),
         tools=[
+            research,
             search_web_multi,
             fetch_urls,
         ],
@@ -107,6 +185,7 @@ def get_agent_team():
         db=team_storage,
         add_history_to_context=True,
         num_history_runs=NUM_HISTORY_RUNS,
+        max_tool_calls_from_history=MAX_HISTORY_TOOL_CALLS,
     )
 
     # brand_finder_agent = Agent(
@@ -220,15 +299,55 @@ def get_agent_team():
     # )
     return product_finder_agent
 
-def main():
+@st.cache_resource(show_spinner=False) # one agent per server process, shared across sessions
+def _get_cached_agent_team():
+    return build_agent_team()
+
+_cli_agent_team = None
+
+def get_agent_team():
+    # outside `streamlit run` cache_resource just probes for a script context (and warns) on every call
+    # -> only go through it under the streamlit runtime, otherwise keep a plain module-level singleton
+    global _cli_agent_team
+    if runtime.exists():
+        return _get_cached_agent_team()
+    if _cli_agent_team is None:
+        _cli_agent_team = build_agent_team()
+    return _cli_agent_team
+
+async def aclose_clients():
+    await aclose_model_client()
+    await aclose_client()
+    await db_engine.dispose()
+
+async def answer(team: Agent, user_input: str):
+    # stream the answer as it's generated (tool calls/results come through as other events -> skipped)
+    # arun since the tools and the db are async, the sync run() refuses them
+    print("🤖 Agno: ", end="", flush=True)
+    async for chunk in team.arun(user_input, stream=True):
+        if getattr(chunk, "event", None) == "RunContent" and chunk.content:
+            print(chunk.content, end="", flush=True)
+    print()
+
+def chat(runner: asyncio.Runner):
     team = get_agent_team()
     print("🤖 Agno CLI Agent is ready. Type 'exit' to quit.")
     while True:
+        # input() stays on the main thread -> Ctrl-C still interrupts it
         user_input = input("💁‍♀️ You: ")
         if user_input.strip().lower() == "exit":
             break
-        response = team.run(user_input)
-        print(f"🤖 Agno: {response.content}")
+        runner.run(answer(team, user_input))
+
+def main():
+    # one loop for the whole session, driven turn by turn: it stays open between turns, so the
+    # HTTP/2 connections (and the db pool) opened on it are reused by the next one
+    with asyncio.Runner() as runner:
+        try:
+            runner.run(warm_up(get_agent_team()))
+            chat(runner)
+        finally:
+            runner.run(aclose_clients())
 
 if __name__ == "__main__":
     main()
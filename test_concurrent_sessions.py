@@ -0,0 +1,88 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+
+# team.py reads its settings at import; the engine and the model connect lazily, so placeholders do here
+for name in ("POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_HOST", "POSTGRES_DB", "OPENAI_API_KEY"):
+    os.environ.setdefault(name, "test")
+
+from agno.db.base import AsyncBaseDb
+from agno.db.postgres import AsyncPostgresDb
+from agno.models.base import Model
+from agno.models.response import ModelResponse
+
+import team
+
+DB_DELAY = 0.3 # seconds per session read / write
+
+
+class SlowSessionDb(AsyncPostgresDb):
+    # stands in for Postgres: sessions live in a dict, every read / write takes DB_DELAY
+    def __init__(self):
+        super().__init__(db_engine=team.db_engine)
+        self.sessions = {}
+
+    async def get_session(self, session_id, session_type, user_id=None, deserialize=True):
+        await asyncio.sleep(DB_DELAY)
+        return self.sessions.get(session_id)
+
+    async def upsert_session(self, session, deserialize=True):
+        await asyncio.sleep(DB_DELAY)
+        self.sessions[session.session_id] = session
+        return session
+
+
+@dataclass
+class StubModel(Model):
+    # answers instantly, so a turn's time is its db time
+    id: str = "stub"
+
+    def invoke(self, *args, **kwargs):
+        return ModelResponse(role="assistant", content="ok")
+
+    async def ainvoke(self, *args, **kwargs):
+        return ModelResponse(role="assistant", content="ok")
+
+    def invoke_stream(self, *args, **kwargs):
+        yield ModelResponse(role="assistant", content="ok")
+
+    async def ainvoke_stream(self, *args, **kwargs):
+        yield ModelResponse(role="assistant", content="ok")
+
+    def _parse_provider_response(self, response, **kwargs):
+        return response
+
+    def _parse_provider_response_delta(self, response):
+        return response
+
+
+def test_storage_is_async():
+    # every streamlit session runs on one shared loop -> a sync db would block all of them on each query
+    assert isinstance(team.team_storage, AsyncBaseDb)
+
+
+def test_overlapping_streams_dont_wait_on_each_others_db(monkeypatch):
+    monkeypatch.setattr(team, "team_storage", SlowSessionDb())
+    monkeypatch.setattr(team, "OpenAIChat", lambda **kwargs: StubModel())
+    agent = team.build_agent_team()
+
+    async def turn(session_id: str) -> str:
+        answer = ""
+        async for event in agent.arun("hi", stream=True, session_id=session_id, user_id=session_id):
+            if getattr(event, "event", None) == "RunContent" and event.content:
+                answer += event.content
+        return answer
+
+    async def timed(*session_ids: str) -> float:
+        start = time.monotonic()
+        answers = await asyncio.gather(*(turn(session_id) for session_id in session_ids))
+        assert all(answer == "ok" for answer in answers)
+        return time.monotonic() - start
+
+    async def run() -> tuple:
+        return await timed("solo"), await timed("a", "b")
+
+    one_turn, two_turns = asyncio.run(run())
+    # back to back (a blocked loop) the pair would take 2x one turn
+    assert two_turns < 1.5 * one_turn
@@ -3,31 +3,52 @@ from agno.tools import tool
 import os
 import httpx
 import asyncio
+import threading
+import re
+import hashlib
+import json
+from collections import OrderedDict
 from typing import List, Dict, Tuple
-from urllib.parse import quote
+from urllib.parse import quote, urlsplit, urlunsplit, parse_qsl, urlencode
 import logging
 import time
 import coloredlogs
 
 logger = logging.getLogger(__name__)
-coloredlogs.install(level=os.getenv("LOG_LEVEL", "INFO"), logger=logger)
+if not logger.handlers: # loggers outlive streamlit reruns -> only install the handler once
+    coloredlogs.install(level=os.getenv("LOG_LEVEL", "INFO"), logger=logger)
 
 # ---------- Constants ----------
 PUREMD_API_URL = "https://pure.md"
 PUREMD_API_KEY = os.environ.get("PUREMD_API_KEY")
-MAX_PARALLEL = 5
+MAX_PARALLEL = int(os.getenv("BATCH_MAX_PARALLEL", "20")) # in-flight requests per kind, multiplexed as HTTP/2 streams
 CACHE_DIR = "/tmp/agno_cache"
 CACHE_TTL = 60*60
-TIMEOUT = 5.0
-MAX_CONNECTIONS = 20
-MAX_KEEPALIVE_CONNECTIONS = 20
+TIMEOUT = 5.0          # overall default (also the wait for a free pooled connection)
+CONNECT_TIMEOUT = 1.0  # fail fast on a dead host...
+READ_TIMEOUT = 4.0     # ...but give a slow page time to arrive
+WRITE_TIMEOUT = 2.0
+CONNECT_RETRIES = 2    # transport-level: only retries failed connects, never a sent request
+# everything goes to one host over HTTP/2 -> streams multiplex on 1-2 connections, a few is plenty
+MAX_CONNECTIONS = 4
+MAX_KEEPALIVE_CONNECTIONS = 4
 HEADERS = {"x-puremd-api-token": PUREMD_API_KEY}
 MAX_QUERIES = 3             # don’t let it fan out more than this
 MAX_CHARS_PER_RESULT = 4000 # ~2–3k tokens max per query
+MAX_BYTES_PER_RESULT = MAX_CHARS_PER_RESULT * 4 # worst case utf-8 -> always enough bytes for the kept characters
+MAX_CACHED_ITEMS = 1024     # in-process cache size for pages / search results (least recently used evicted first)
+MAX_RESULTS_PER_SEARCH = 5  # results kept from each search response once compacted
+MAX_SNIPPET_CHARS = 200
+MAX_RESEARCH_PAGES = 8      # hard cap on pages `research` fetches, whatever max_fetch the model asks for
+
+# links in search results (plain or markdown `[title](url)`), compiled once at import
+URL_PATTERN = re.compile(r'https?://[^\s)"\'<>\]]+')
 
 # ---------- Shared HTTP client (HTTP/2 + pooling) ----------
+# One client for every tool call: all agent runs happen on a single event loop (the app's shared loop / the
+# CLI's Runner), and that's the loop its pool binds to on first use.
+# aclose_client() closes it (app shutdown / end of the CLI)
 _http_client: httpx.AsyncClient | None = None
-_client_lock = asyncio.Lock()
 
 async def get_client() -> httpx.AsyncClient:
     """
@@ -36,25 +57,168 @@ async def get_client() -> httpx.AsyncClient:
     """
     global _http_client
     if _http_client is None:
-        async with _client_lock:
-            if _http_client is None:
-                _http_client = httpx.AsyncClient(
-                    http2=True,
-                    timeout=httpx.Timeout(TIMEOUT),
-                    limits=httpx.Limits(
-                        max_connections=MAX_CONNECTIONS,
-                        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
-                    ),
-                    headers=HEADERS
-                )
+        _http_client = _new_client()
     return _http_client
 
+def _new_client() -> httpx.AsyncClient:
+    # http2 / limits have to live on the transport: the client ignores its own once one is passed
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=CONNECT_RETRIES,
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        ),
+    )
+    return httpx.AsyncClient(
+        transport=transport,
+        timeout=httpx.Timeout(TIMEOUT, connect=CONNECT_TIMEOUT, read=READ_TIMEOUT, write=WRITE_TIMEOUT),
+        headers=HEADERS
+    )
+
+async def aclose_client() -> None:
+    """Close the client and its pooled connections; the next get_client() opens a new one."""
+    global _http_client
+    client, _http_client = _http_client, None
+    if client is not None:
+        await client.aclose()
+
+
+# ---------- Per-item cache (memory + disk) ----------
+# agno's cache_results keys on the whole argument list, so a batch of [A, B, C] and a later [A, B, D]
+# share nothing -> cache each page / search result by itself instead, in front of the HTTP call.
+# Hot items stay in process (least recently used evicted first), everything also lands on disk to survive restarts.
+# Empty results aren't cached -> a transient blank page / search doesn't stick for the whole TTL.
+# Expired files are removed when read, and a sweep (at most once per CACHE_TTL) clears the ones nobody asks for.
+# The disk tier (reads, writes, sweep) runs on worker threads, so it never blocks the event loop.
+ITEM_CACHE_DIR = os.path.join(CACHE_DIR, "items")
+_item_cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+_item_cache_lock = threading.Lock() # pop / evict / insert must not interleave across threads
+_last_sweep = 0.0
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def _normalize_url(u: str) -> str:
+    # same page -> same cache key: "HTTPS://Roots.com:443/a?b=2&a=1#top" == "https://roots.com/a?a=1&b=2"
+    # relative pure.md paths (e.g. "canadian-brands/umbrellas") are only stripped
+    # urls with userinfo are left as given -> different credentials never share an entry
+    u = u.strip()
+    parts = urlsplit(u)
+    if not parts.scheme or not parts.netloc or "@" in parts.netloc:
+        return u
+    scheme = parts.scheme.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        return u
+    # host from netloc, not `hostname`: that one drops the [...] around an IPv6 address ("http://::1:8080/")
+    netloc = parts.netloc
+    host = (netloc[:netloc.rindex(":")] if netloc.rfind(":") > netloc.rfind("]") else netloc).lower()
+    netloc = host if port is None or DEFAULT_PORTS.get(scheme) == port else f"{host}:{port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+def _page_key(u: str) -> str:
+    # shared by fetch_url_contents / fetch_urls / research so any of them can serve the others' pages
+    return f"page:{_normalize_url(u)}"
+
+def _cache_path(key: str) -> str:
+    return os.path.join(ITEM_CACHE_DIR, hashlib.sha1(key.encode()).hexdigest())
+
+def _remember(key: str, text: str, stored_at: float) -> None:
+    with _item_cache_lock:
+        _item_cache.pop(key, None)
+        if len(_item_cache) >= MAX_CACHED_ITEMS:
+            _item_cache.popitem(last=False)
+        _item_cache[key] = (stored_at, text)
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass # already gone (e.g. removed by another worker)
+
+def _sweep_disk_cache() -> None:
+    # drop expired files that are never read again (they'd otherwise pile up forever)
+    global _last_sweep
+    now = time.time()
+    with _item_cache_lock:
+        if now - _last_sweep < CACHE_TTL:
+            return
+        _last_sweep = now
+    try:
+        with os.scandir(ITEM_CACHE_DIR) as entries:
+            for entry in entries:
+                try:
+                    if now - entry.stat().st_mtime > CACHE_TTL:
+                        _remove_file(entry.path)
+                except OSError:
+                    pass
+    except OSError as e:
+        logger.warning("Couldn't sweep cache dir %s: %s", ITEM_CACHE_DIR, e)
+
+def _memory_get(key: str) -> str | None:
+    with _item_cache_lock:
+        hit = _item_cache.get(key)
+        if hit is None:
+            return None
+        stored_at, text = hit
+        if time.time() - stored_at <= CACHE_TTL:
+            _item_cache.move_to_end(key)
+            return text
+        _item_cache.pop(key, None)
+    return None
+
+def _disk_get(key: str) -> str | None:
+    path = _cache_path(key)
+    try:
+        stored_at = os.path.getmtime(path)
+        if time.time() - stored_at > CACHE_TTL:
+            _remove_file(path)
+            return None
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+    except OSError:
+        return None
+    if not text.strip():
+        return None # treat a blank file as a miss, same as never cached
+    _remember(key, text, stored_at)
+    return text
+
+def _disk_set(key: str, text: str) -> None:
+    path = _cache_path(key)
+    try:
+        os.makedirs(ITEM_CACHE_DIR, exist_ok=True)
+        # write + rename so a concurrent reader never sees a half-written file
+        # (tmp name per process and thread: writes of the same key can run side by side on worker threads)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Couldn't write cache entry %s: %s", path, e)
+        return
+    _sweep_disk_cache()
+
+async def _cache_get(key: str) -> str | None:
+    # memory hits stay inline, only a miss goes to disk
+    text = _memory_get(key)
+    if text is None:
+        text = await asyncio.to_thread(_disk_get, key)
+    return text
+
+async def _cache_set(key: str, text: str) -> None:
+    if not text.strip():
+        return
+    _remember(key, text, time.time())
+    await asyncio.to_thread(_disk_set, key, text) # write (+ the occasional sweep) off the loop
+
 
 # =========================
 # Single-item tools
 # =========================
 
-@tool(cache_results=True, cache_dir=CACHE_DIR, cache_ttl=CACHE_TTL)
+@tool  # cached per item
 async def fetch_url_contents(url: str = '') -> str:
     """
     Fetch the contents (HTML or text) of a single URL.
@@ -67,21 +231,17 @@ async def fetch_url_contents(url: str = '') -> str:
     - url (str): Relative or absolute path to fetch (e.g., "article/123" or "https://...").
 
     RETURNS
-    - str: Raw response text. Empty string on non-200 or invalid input.
+    - str: Raw response text (first 4000 characters). Empty string on non-200 or invalid input.
 
     EXAMPLES
     - Use for a single detail page you’re certain about.
     - If you need to fetch 3–10 pages, **use `fetch_urls` instead**.
     """
-    if isinstance(url, str) and url.strip():
-        client = await get_client()
-        r = await client.get(f'{PUREMD_API_URL}/{url}')
-        if r.status_code == 200:
-            return r.text
-    return ""
+    _, text = await _fetch_one(url)
+    return text
 
 
-@tool(cache_results=True, cache_dir=CACHE_DIR, cache_ttl=CACHE_TTL)
+@tool  # cached per item
 async def search_web(query: str = '') -> str:
     """
     Run a single web search query.
@@ -94,18 +254,15 @@ async def search_web(query: str = '') -> str:
     - query (str): A clear, specific search term or question.
 
     RETURNS
-    - str: Raw JSON/text from the search endpoint. Empty string on error/invalid input.
+    - str: The search results (first 4000 characters). Empty string on error/invalid input.
+      Results come back as markdown lines `- [title](url): snippet` when the response can be parsed.
 
     EXAMPLES
     - ONE query to orient yourself.
     - For 2+ queries (e.g., brand variations, model comparisons), **use `search_web_multi`** instead.
     """
-    if isinstance(query, str) and query.strip():
-        client = await get_client()
-        r = await client.get(f'{PUREMD_API_URL}/search?q={quote(query)}')
-        r.raise_for_status()
-        return r.text
-    return ""
+    _, text = await _search_one(query)
+    return text
 
 
 # =========================
@@ -113,9 +270,92 @@ async def search_web(query: str = '') -> str:
 # =========================
 
 # Optional: cap parallelism to avoid over-fan-out
-_semaphore = asyncio.Semaphore(MAX_PARALLEL)
+# one per kind of request -> slow page fetches can't hold up searches (and vice versa)
+# (like the client they bind to the single loop the tools run on, the first time they're waited on)
+_semaphores: Dict[str, asyncio.Semaphore] = {
+    "search": asyncio.Semaphore(MAX_PARALLEL),
+    "fetch": asyncio.Semaphore(MAX_PARALLEL),
+}
+
+def get_semaphore(kind: str) -> asyncio.Semaphore:
+    return _semaphores[kind]
+
+async def _fetch_one(u: str) -> Tuple[str, str]:
+    # page text capped at MAX_CHARS_PER_RESULT, "" on failure -> one bad url doesn't sink the batch
+    if not isinstance(u, str) or not u.strip():
+        return (u, "")
+    path = u.strip()
+    key = _page_key(path)
+    cached = await _cache_get(key)
+    if cached is not None:
+        return (u, cached)
+    # build the request url before taking the semaphore -> it's only held for the actual I/O
+    url = f'{PUREMD_API_URL}/{path}'
+    client = await get_client()
+    try:
+        async with get_semaphore("fetch"):
+            # stream the body and stop once we have enough -> big pages don't get fully downloaded + decoded
+            async with client.stream("GET", url) as r:
+                if r.status_code != 200:
+                    return (u, "")
+                buf = bytearray()
+                async for chunk in r.aiter_bytes():
+                    buf.extend(chunk)
+                    if len(buf) >= MAX_BYTES_PER_RESULT:
+                        break
+                encoding = r.encoding or "utf-8"
+        text = buf.decode(encoding, errors="ignore")[:MAX_CHARS_PER_RESULT]
+        await _cache_set(key, text)
+        return (u, text)
+    except (httpx.HTTPError, httpx.InvalidURL):
+        return (u, "")
+
+def _compact_search(text: str) -> str:
+    # the search endpoint answers with JSON -> keep just title / url / snippet of the top results as markdown
+    # (a fraction of the tokens of the raw blob). Anything that isn't shaped like that comes back untouched.
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return text
+    results = data.get("results") if isinstance(data, dict) else data
+    if not isinstance(results, list):
+        return text
+    lines = []
+    for result in results:
+        if not isinstance(result, dict):
+            continue
+        url = result.get("url") or result.get("link")
+        if not isinstance(url, str) or not url:
+            continue
+        title = " ".join(str(result.get("title") or url).split())
+        snippet = " ".join(str(result.get("snippet") or result.get("description") or "").split())[:MAX_SNIPPET_CHARS]
+        lines.append(f"- [{title}]({url}): {snippet}" if snippet else f"- [{title}]({url})")
+        if len(lines) >= MAX_RESULTS_PER_SEARCH:
+            break
+    return "\n".join(lines) if lines else text
+
+async def _search_one(q: str) -> Tuple[str, str]:
+    if not isinstance(q, str) or not q.strip():
+        return (q, "")
+    key = f"search:{q.strip()}"
+    cached = await _cache_get(key)
+    if cached is not None:
+        return (q, cached[:MAX_CHARS_PER_RESULT])
+    url = f'{PUREMD_API_URL}/search?q={quote(q)}'
+    client = await get_client()
+    try:
+        async with get_semaphore("search"):
+            r = await client.get(url)
+        # branch instead of raise_for_status() -> a 429 / 5xx doesn't build and unwind an exception
+        if r.status_code != 200:
+            return (q, "")
+        text = _compact_search(r.text)
+        await _cache_set(key, text)
+        return (q, text[:MAX_CHARS_PER_RESULT])
+    except (httpx.HTTPError, httpx.InvalidURL):
+        return (q, "")
 
-@tool(cache_results=True, cache_dir=CACHE_DIR, cache_ttl=CACHE_TTL)
+@tool # cached per item (see _cache_get), not per call
 async def fetch_urls(urls: List[str]) -> Dict[str, str]:
     """
     Fetch multiple URLs **in parallel** (fast path). Prefer this over repeated `fetch_url_contents`.
@@ -132,7 +372,7 @@ async def fetch_urls(urls: List[str]) -> Dict[str, str]:
 
     BEHAVIOR & PERFORMANCE
     - Uses a shared HTTP/2 client and parallelizes with `asyncio.gather`.
-    - Rate-limited by a semaphore (default 10 concurrent). Tune via env `BATCH_MAX_PARALLEL`.
+    - Rate-limited by a semaphore (default 20 concurrent). Tune via env `BATCH_MAX_PARALLEL`.
 
     MODEL GUIDANCE
     - If you're about to call `fetch_url_contents` multiple times, **combine them into one**
@@ -146,29 +386,21 @@ async def fetch_urls(urls: List[str]) -> Dict[str, str]:
     ...   "https://pure.md/canadian-brands/umbrellas/vancouver-umbrella",
     ... ])
     """
-    start_time = time.time()
-    dedup = list(dict.fromkeys(urls or []))[:50]
-    
-    client = await get_client()
+    start_time = time.monotonic()
+    requested = list(dict.fromkeys(urls or []))[:50]
 
-    async def one(u: str) -> Tuple[str, str]:
-        if not isinstance(u, str) or not u.strip():
-            return (u, "")
-        try:
-            async with _semaphore:
-                r = await client.get(f'{PUREMD_API_URL}/{u}')
-            return (u, r.text[:MAX_CHARS_PER_RESULT] if r.status_code == 200 else "")
-        except Exception:
-            return (u, "")
-
-    # Small safety: de-dup to avoid wasted calls
-    results = await asyncio.gather(*[one(u) for u in dedup], return_exceptions=False)
-    elapsed = time.time() - start_time
-    logger.info(f"  → Fetched {len(dedup)} URLs in {elapsed:.2f}s")
-    return {u: text for (u, text) in results}
+    # Small safety: de-dup by cache key to avoid wasted calls -> spellings of the same page share one fetch
+    keys = [_page_key(u) if isinstance(u, str) else u for u in requested]
+    first_by_key = {}
+    for key, u in zip(keys, requested):
+        first_by_key.setdefault(key, u)
+    results = dict(await asyncio.gather(*[_fetch_one(u) for u in first_by_key.values()], return_exceptions=False))
+    elapsed = time.monotonic() - start_time
+    logger.info(f"  → Fetched {len(first_by_key)} URLs in {elapsed:.2f}s")
+    return {u: results[first_by_key[key]] for key, u in zip(keys, requested)}
 
 
-@tool(cache_results=True, cache_dir=CACHE_DIR, cache_ttl=CACHE_TTL)
+@tool # cached per item (see _cache_get), not per call
 async def search_web_multi(queries: List[str]) -> Dict[str, str]:
     """
     Run multiple web search queries **in parallel** (fast path). Prefer this over repeated `search_web`.
@@ -181,10 +413,11 @@ async def search_web_multi(queries: List[str]) -> Dict[str, str]:
     - queries (List[str]): A list of search strings. Empty/invalid items are ignored.
 
     RETURNS
-    - Dict[str, str]: A mapping of `query -> raw_search_response_text` (empty string if failed).
+    - Dict[str, str]: A mapping of `query -> search_results` (empty string if failed).
+      Results come back as markdown lines `- [title](url): snippet` when the response can be parsed.
 
     BEHAVIOR & PERFORMANCE
-    - Uses a shared HTTP/2 client and parallelization with a concurrency cap (default 10).
+    - Uses a shared HTTP/2 client and parallelization with a concurrency cap (default 20).
     - This minimizes round-trips compared to serial tool calls.
     - Limits the total number of queries to 3 and the total number of characters per result to 4000.
 
@@ -201,24 +434,84 @@ async def search_web_multi(queries: List[str]) -> Dict[str, str]:
     ...   "Vancouver Umbrella made in Canada",
     ... ])
     """
-    start_time = time.time()
+    start_time = time.monotonic()
     dedup = list(dict.fromkeys(queries or []))[:MAX_QUERIES]
-    
-    client = await get_client()
-
-    async def one(q: str) -> Tuple[str, str]:
-        if not isinstance(q, str) or not q.strip():
-            return (q, "")
-        try:
-            async with _semaphore:
-                r = await client.get(f'{PUREMD_API_URL}/search?q={quote(q)}')
-            r.raise_for_status()
-            return (q, r.text[:MAX_CHARS_PER_RESULT])
-        except Exception:
-            return (q, "")
 
     # Small safety: de-dup to avoid wasted calls
-    results = await asyncio.gather(*[one(q) for q in dedup], return_exceptions=False)
-    elapsed = time.time() - start_time
+    results = await asyncio.gather(*[_search_one(q) for q in dedup], return_exceptions=False)
+    elapsed = time.monotonic() - start_time
     logger.info(f"  → Searched {len(dedup)} queries in {elapsed:.2f}s")
     return {q: text for (q, text) in results}
+
+
+# =========================
+# Fused search + fetch (fastest path)
+# =========================
+
+@tool # cached per item (see _cache_get), not per call
+async def research(queries: List[str], max_fetch: int = 5) -> Dict[str, Dict[str, str]]:
+    """
+    Search the web AND read the top result pages in ONE call. Prefer this over
+    `search_web_multi` followed by `fetch_urls`.
+
+    WHEN TO USE
+    - You're starting on a request and need both search results and the pages behind them.
+    - Saves a whole model round-trip compared to searching, reading the results, then fetching.
+
+    ARGS
+    - queries (List[str]): A list of search strings (max 3). Empty/invalid items are ignored.
+    - max_fetch (int): How many of the result URLs to fetch (default 5, capped at 8).
+
+    RETURNS
+    - Dict with two mappings:
+      - "searches": `query -> search_results` (markdown `- [title](url): snippet` lines)
+      - "pages": `url -> page_text` for up to `max_fetch` unique result URLs, split across the queries
+
+    BEHAVIOR & PERFORMANCE
+    - Searches run in parallel and each one's top pages start fetching as soon as it returns.
+    - Same limits as the batch tools: 3 queries, 4000 characters per search result / page.
+
+    MODEL GUIDANCE
+    - Use this for the first pass. Only follow up with `fetch_urls` for specific pages the
+      results didn't cover (e.g. a brand's own product page).
+
+    EXAMPLE
+    >>> await research([
+    ...   "Top Canadian umbrella brands",
+    ...   "Umbrellas made in Canada",
+    ... ], max_fetch=5)
+    """
+    start_time = time.monotonic()
+    dedup = list(dict.fromkeys(queries or []))[:MAX_QUERIES]
+    if not isinstance(max_fetch, int):
+        max_fetch = 5
+    max_fetch = max(0, min(max_fetch, MAX_RESEARCH_PAGES))
+
+    # pipeline: start fetching a search's links as soon as that search lands, instead of waiting on the slowest one
+    # each query gets a fair share of the fetch budget so the fastest search can't take every slot
+    per_query = -(-max_fetch // len(dedup)) if dedup else 0
+    searches: Dict[str, str] = {}
+    fetches: Dict[str, asyncio.Task] = {}
+    started = set() # normalized page keys, so two spellings of one url only get fetched once
+    for next_search in asyncio.as_completed([_search_one(q) for q in dedup]):
+        q, text = await next_search
+        searches[q] = text
+        taken = 0
+        # pull the result links out of the raw search text (in result order), skipping ones already started
+        # finditer -> stops scanning the text as soon as this query's share is taken
+        for match in URL_PATTERN.finditer(text):
+            if taken >= per_query or len(fetches) >= max_fetch:
+                break
+            u = match.group(0).rstrip(".,;:")
+            if _page_key(u) not in started:
+                started.add(_page_key(u))
+                fetches[u] = asyncio.create_task(_fetch_one(u))
+                taken += 1
+
+    pages = await asyncio.gather(*fetches.values())
+    elapsed = time.monotonic() - start_time
+    logger.info(f"  → Researched {len(dedup)} queries + {len(fetches)} pages in {elapsed:.2f}s")
+    return {
+        "searches": {q: searches[q] for q in dedup}, # back in the order they were asked
+        "pages": dict(pages),
+    }